@@ -9,6 +9,11 @@ Endpoints:
 - GET /api/bmk?hours=48 (or days=7) (or since=...&until=...)
 - GET /api/fronius?limit=5000
 - GET /api/bmk?limit=5000
+- GET /api/fronius?days=7&bucket=5m   (averaged per bucket: 60s, 5m, 1h, 1d, ...)
+
+/api/fronius and /api/bmk return columnar data (column names emitted once):
+    {"columns": ["ts", "pv_kw", ...], "data": {"ts": [...], "pv_kw": [...], ...}}
+Same payload as MessagePack with ?format=msgpack (or header Accept: application/msgpack).
 
 Environment:
     DATA_DIR="/home/pi/datenerfassung"
@@ -16,28 +21,113 @@ Environment:
     HOST="0.0.0.0"
     PORT="5000"
     AUTH_TOKEN=""         # optional. If set: require header X-Auth-Token: <token>
+    CACHE_TTL_S="1.5"     # in-memory cache for /api/fronius + /api/bmk responses (max 16 MB, bodies <= 2 MB)
+
+JSON responses >= 1 KB are compressed (br/gzip) when the client accepts it.
+/api/fronius and /api/bmk send a weak ETag (checksum of the encoded body), /api/latest one
+built from the newest fronius/bmk ts; all answer If-None-Match with 304 Not Modified.
 """
 
 from __future__ import annotations
 
 import os
 import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Flask, abort, jsonify, request
+import msgspec
+import orjson
+from flask import Flask, Response, abort, request
+from flask_compress import Compress
 
 app = Flask(__name__)
+# JSON only; MessagePack is already dense and stays uncompressed
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_MIN_SIZE"] = 1024
+Compress(app)
 
 DATA_DIR = Path(os.getenv("DATA_DIR", ".")).expanduser().resolve()
 DB_FILE = DATA_DIR / os.getenv("DB_FILE", "energy.db")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "5000"))
 AUTH_TOKEN = os.getenv("AUTH_TOKEN", "").strip()
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "1.5"))
+CACHE_MAX_ENTRIES = 64
+CACHE_MAX_BYTES = 16 * 1024 * 1024  # total size of cached bodies
+CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024  # larger bodies are not cached
+
+# reused encoder instance (amortizes type dispatch)
+_MSGPACK = msgspec.msgpack.Encoder()
+# one read-only connection + cursor per worker thread, kept open for the thread's lifetime
+_tls = threading.local()
+# (table, query args, msgpack) -> (created monotonic, body, mimetype, etag); LRU order
+_CACHE: "OrderedDict[Tuple[Any, ...], Tuple[float, bytes, str, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_bytes = 0
+
+_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "fronius": ("ts", "pv_kw", "grid_kw", "battery_kw", "load_kw", "soc"),
+    "bmk": ("ts", "boiler_temp", "outside_temp", "buffer_top", "buffer_mid", "buffer_bottom", "hot_water"),
+}
+
+_WHERE: Dict[str, str] = {
+    "all": "",
+    "since": "WHERE ts >= ?",
+    "until": "WHERE ts <= ?",
+    "both": "WHERE ts >= ? AND ts <= ?",
+}
+
+
+# ts bucket start (same TEXT format as collector); bucket size in seconds is bound twice
+_BUCKET_TS = "datetime((CAST(strftime('%s', ts) AS INTEGER) / ?) * ?, 'unixepoch')"
+
+_BUCKET_UNITS: Dict[str, int] = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_BUCKET_MAX_S = 366 * 86400
+
+
+def _build_sql() -> Tuple[Dict[Tuple[str, str], str], Dict[Tuple[str, str], str], Dict[str, str]]:
+    # fixed SQL strings -> sqlite3's per-connection statement cache reuses the compiled statements
+    rows: Dict[Tuple[str, str], str] = {}
+    bucketed: Dict[Tuple[str, str], str] = {}
+    latest: Dict[str, str] = {}
+    for table, cols in _COLUMNS.items():
+        col_list = ", ".join(cols)
+        avg_list = ", ".join(f"AVG({c}) AS {c}" for c in cols if c != "ts")
+        for shape, where in _WHERE.items():
+            rows[(table, shape)] = f"SELECT {col_list} FROM {table} {where} ORDER BY ts ASC LIMIT ?"
+            bucketed[(table, shape)] = (
+                f"SELECT {_BUCKET_TS} AS bucket_ts, {avg_list} FROM {table} {where} "
+                f"GROUP BY 1 ORDER BY 1 ASC LIMIT ?"
+            )
+        latest[table] = f"SELECT {col_list} FROM {table} ORDER BY ts DESC LIMIT 1"
+    return rows, bucketed, latest
 
-# keep a single read-only connection per process
-_conn: Optional[sqlite3.Connection] = None
+
+_PREPARED, _PREPARED_BUCKET, _PREPARED_LATEST = _build_sql()
+_LATEST_TS: Dict[str, str] = {t: f"SELECT ts FROM {t} ORDER BY ts DESC LIMIT 1" for t in _COLUMNS}
+
+
+def _json(payload: Dict[str, Any]) -> Response:
+    return Response(orjson.dumps(payload), mimetype="application/json")
+
+
+def _wants_msgpack() -> bool:
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt.lower() == "msgpack"
+    return "application/msgpack" in request.headers.get("Accept", "")
+
+
+def _serialize(payload: Dict[str, Any], as_msgpack: bool) -> Tuple[bytes, str]:
+    if as_msgpack:
+        return _MSGPACK.encode(payload), "application/msgpack"
+    return orjson.dumps(payload), "application/json"
 
 
 def _require_token_if_configured() -> None:
@@ -49,20 +139,32 @@ def _require_token_if_configured() -> None:
 
 
 def _connect() -> sqlite3.Connection:
-    global _conn
-    if _conn is None:
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
         DB_FILE.parent.mkdir(parents=True, exist_ok=True)
-        _conn = sqlite3.connect(
-            str(DB_FILE),
+        # read-only: never competes with the collector's writer (WAL mode is set by the collector)
+        conn = sqlite3.connect(
+            DB_FILE.as_uri() + "?mode=ro",  # as_uri() percent-encodes #, ?, % and spaces
+            uri=True,
             timeout=30,
             isolation_level=None,
-            check_same_thread=False,
         )
-        _conn.row_factory = sqlite3.Row
-        _conn.execute("PRAGMA journal_mode=WAL;")
-        _conn.execute("PRAGMA synchronous=NORMAL;")
-        _conn.execute("PRAGMA busy_timeout=30000;")
-    return _conn
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=30000;")
+        conn.execute("PRAGMA cache_size=-20000;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA mmap_size=268435456;")
+        conn.execute("PRAGMA query_only=1;")
+        _tls.conn = conn
+    return conn
+
+
+def _cursor() -> sqlite3.Cursor:
+    cur = getattr(_tls, "cursor", None)
+    if cur is None:
+        cur = _connect().cursor()
+        _tls.cursor = cur
+    return cur
 
 
 def _parse_dt(s: str) -> datetime:
@@ -87,7 +189,7 @@ def _window_from_args() -> Tuple[Optional[str], Optional[str]]:
         days = request.args.get("days")
         since_dt = None
         until_dt = None
-        now = datetime.now().replace(microsecond=0)
+        now = datetime.now()  # microseconds are dropped when formatting below
         if hours:
             try:
                 h = float(hours)
@@ -108,65 +210,173 @@ def _window_from_args() -> Tuple[Optional[str], Optional[str]]:
     return since_txt, until_txt
 
 
-def _query_rows(table: str, since: Optional[str], until: Optional[str], limit: int) -> List[Dict[str, Any]]:
-    conn = _connect()
+def _bucket_from_args() -> Optional[int]:
+    """
+    Returns the bucket size in seconds for ?bucket=60s|5m|1h|1d (plain number = seconds), else None.
+    """
+    raw = (request.args.get("bucket") or "").strip().lower()
+    if not raw:
+        return None
+    unit = _BUCKET_UNITS.get(raw[-1])
+    num = raw[:-1] if unit else raw
+    try:
+        seconds = int(float(num) * (unit or 1))
+    except (ValueError, OverflowError):  # e.g. "abc", "infm", "1e400"
+        return None
+    # larger buckets make no sense (and would overflow SQLite's INTEGER when bound)
+    return seconds if 0 < seconds <= _BUCKET_MAX_S else None
+
+
+def _query_rows(
+    table: str,
+    since: Optional[str],
+    until: Optional[str],
+    limit: int,
+    bucket_s: Optional[int] = None,
+) -> Dict[str, List[Any]]:
+    """
+    Returns the window as columns: {column: [values...]} (rows transposed, no per-row dicts).
+    With bucket_s, rows are averaged in SQL per bucket and ts is the bucket start.
+    """
     limit = max(1, min(int(limit), 200000))  # guard
-    params: Dict[str, Any] = {"limit": limit}
 
-    where = ""
     if since and until:
-        where = "WHERE ts >= :since AND ts <= :until"
-        params["since"] = since
-        params["until"] = until
+        shape, params = "both", (since, until, limit)
     elif since:
-        where = "WHERE ts >= :since"
-        params["since"] = since
+        shape, params = "since", (since, limit)
     elif until:
-        where = "WHERE ts <= :until"
-        params["until"] = until
+        shape, params = "until", (until, limit)
+    else:
+        shape, params = "all", (limit,)
+
+    if bucket_s:
+        sql = _PREPARED_BUCKET[(table, shape)]
+        params = (bucket_s, bucket_s) + params
+    else:
+        sql = _PREPARED[(table, shape)]
 
-    sql = f"SELECT * FROM {table} {where} ORDER BY ts ASC LIMIT :limit"
-    rows = conn.execute(sql, params).fetchall()
-    return [dict(r) for r in rows]
+    rows = _cursor().execute(sql, params).fetchall()
+    cols = _COLUMNS[table]
+    if not rows:
+        return {c: [] for c in cols}
+    return {c: list(values) for c, values in zip(cols, zip(*rows))}
 
 
 def _query_latest(table: str) -> Optional[Dict[str, Any]]:
-    conn = _connect()
-    r = conn.execute(f"SELECT * FROM {table} ORDER BY ts DESC LIMIT 1").fetchone()
-    return dict(r) if r else None
+    r = _cursor().execute(_PREPARED_LATEST[table]).fetchone()
+    return dict(zip(_COLUMNS[table], r)) if r else None
+
+
+def _latest_etag(fronius_ts: Optional[str], bmk_ts: Optional[str]) -> str:
+    return f"{fronius_ts or '-'}|{bmk_ts or '-'}".replace(" ", "T")
+
+
+def _window_etag(body: bytes) -> str:
+    # bucketed averages can change without the window's ts range changing -> hash the body
+    return f"{len(body):x}-{zlib.crc32(body):08x}"
+
+
+def _cache_pop(key: Tuple[Any, ...]) -> None:
+    # caller holds _cache_lock
+    global _cache_bytes
+    entry = _CACHE.pop(key, None)
+    if entry is not None:
+        _cache_bytes -= len(entry[1])
+
+
+def _cache_get(key: Tuple[Any, ...]) -> Optional[Tuple[float, bytes, str, str]]:
+    with _cache_lock:
+        hit = _CACHE.get(key)
+        if hit is None:
+            return None
+        if time.monotonic() - hit[0] >= CACHE_TTL_S:
+            _cache_pop(key)
+            return None
+        _CACHE.move_to_end(key)
+        return hit
+
+
+def _cache_put(key: Tuple[Any, ...], entry: Tuple[float, bytes, str, str]) -> None:
+    global _cache_bytes
+    if len(entry[1]) > CACHE_MAX_ENTRY_BYTES:
+        return
+    with _cache_lock:
+        now = time.monotonic()
+        for k in [k for k, e in _CACHE.items() if now - e[0] >= CACHE_TTL_S]:
+            _cache_pop(k)
+        _cache_pop(key)
+        _CACHE[key] = entry
+        _cache_bytes += len(entry[1])
+        while len(_CACHE) > CACHE_MAX_ENTRIES or _cache_bytes > CACHE_MAX_BYTES:
+            _cache_pop(next(iter(_CACHE)))
+
+
+def _window_response(table: str) -> Response:
+    as_msgpack = _wants_msgpack()
+    key = (table, tuple(sorted(request.args.items())), as_msgpack)
+
+    entry = _cache_get(key)
+    if entry is None:
+        since, until = _window_from_args()
+        limit = int(request.args.get("limit", "5000"))
+        data = _query_rows(table, since, until, limit, _bucket_from_args())
+        body, mimetype = _serialize({"columns": _COLUMNS[table], "data": data}, as_msgpack)
+        entry = (time.monotonic(), body, mimetype, _window_etag(body))
+        _cache_put(key, entry)
+
+    _, body, mimetype, etag = entry
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype=mimetype)
+    resp.set_etag(etag, weak=True)
+    return resp
 
 
 @app.get("/api/health")
 def health():
     _require_token_if_configured()
     exists = DB_FILE.exists()
-    return jsonify(status="ok", data_dir=str(DATA_DIR), db=str(DB_FILE), db_exists=exists)
+    return _json({"status": "ok", "data_dir": str(DATA_DIR), "db": str(DB_FILE), "db_exists": exists})
 
 
 @app.get("/api/latest")
 def latest():
     _require_token_if_configured()
-    return jsonify(fronius=_query_latest("fronius"), bmk=_query_latest("bmk"))
+    cur = _cursor()
+    if request.if_none_match:
+        # cheap PK lookups first; skip the full rows if nothing advanced
+        f_ts = cur.execute(_LATEST_TS["fronius"]).fetchone()
+        b_ts = cur.execute(_LATEST_TS["bmk"]).fetchone()
+        etag = _latest_etag(f_ts[0] if f_ts else None, b_ts[0] if b_ts else None)
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+
+    f = _query_latest("fronius")
+    b = _query_latest("bmk")
+    resp = _json({"fronius": f, "bmk": b})
+    resp.set_etag(_latest_etag(f["ts"] if f else None, b["ts"] if b else None), weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 @app.get("/api/fronius")
 def fronius():
     _require_token_if_configured()
-    since, until = _window_from_args()
-    limit = int(request.args.get("limit", "5000"))
-    data = _query_rows("fronius", since, until, limit)
-    return jsonify(rows=data)
+    return _window_response("fronius")
 
 
 @app.get("/api/bmk")
 def bmk():
     _require_token_if_configured()
-    since, until = _window_from_args()
-    limit = int(request.args.get("limit", "5000"))
-    data = _query_rows("bmk", since, until, limit)
-    return jsonify(rows=data)
+    return _window_response("bmk")
 
 
 if __name__ == "__main__":
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    app.run(host=HOST, port=PORT)
+    from waitress import serve
+
+    serve(app, host=HOST, port=PORT, threads=4, connection_limit=64)
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import gzip
 import os
 import sqlite3
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-from flask import Flask, jsonify, Response
+import orjson
+from flask import Flask, Response, request
 
 app = Flask(__name__)
 
@@ -14,21 +18,27 @@ DATA_DIR = Path(os.getenv("DATA_DIR", "/home/laurenz2/datenerfassung")).expandus
 DB_FILE = DATA_DIR / os.getenv("DB_FILE", "energy.db")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "5000"))
+# each open /api/latest/stream holds one waitress thread; extra clients get 503 and fall back to polling
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", "8"))
 
-_conn: Optional[sqlite3.Connection] = None
+# one connection per worker thread, kept open for the thread's lifetime
+_tls = threading.local()
 
 
 def _connect() -> sqlite3.Connection:
-    global _conn
-    if _conn is None:
+    conn: Optional[sqlite3.Connection] = getattr(_tls, "conn", None)
+    if conn is None:
         DATA_DIR.mkdir(parents=True, exist_ok=True)
-        _conn = sqlite3.connect(str(DB_FILE), timeout=30, check_same_thread=False)
-        _conn.row_factory = sqlite3.Row
-        _conn.execute("PRAGMA journal_mode=WAL;")
-        _conn.execute("PRAGMA synchronous=NORMAL;")
-        _conn.execute("PRAGMA busy_timeout=30000;")
+        conn = sqlite3.connect(str(DB_FILE), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=30000;")
+        conn.execute("PRAGMA cache_size=-20000;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA mmap_size=268435456;")
 
-        _conn.execute(
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS fronius(
                 ts TEXT PRIMARY KEY,
@@ -37,10 +47,10 @@ def _connect() -> sqlite3.Connection:
                 battery_kw REAL,
                 load_kw REAL,
                 soc REAL
-            );
+            ) WITHOUT ROWID;
             """
         )
-        _conn.execute(
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS bmk(
                 ts TEXT PRIMARY KEY,
@@ -50,28 +60,93 @@ def _connect() -> sqlite3.Connection:
                 buffer_mid REAL,
                 buffer_bottom REAL,
                 hot_water REAL
-            );
+            ) WITHOUT ROWID;
             """
         )
-    return _conn
+        _tls.conn = conn
+    return conn
 
 
-@app.get("/api/health")
-def health():
-    return jsonify(status="ok", data_dir=str(DATA_DIR), db=str(DB_FILE), db_exists=DB_FILE.exists())
+def _json(payload: Dict[str, Any]) -> Response:
+    # sqlite3.Row -> dict via default
+    return Response(orjson.dumps(payload, default=dict), mimetype="application/json")
 
 
-@app.get("/api/latest")
-def latest():
-    c = _connect()
-    f = c.execute("SELECT * FROM fronius ORDER BY ts DESC LIMIT 1").fetchone()
-    b = c.execute("SELECT * FROM bmk ORDER BY ts DESC LIMIT 1").fetchone()
-    return jsonify(fronius=dict(f) if f else None, bmk=dict(b) if b else None)
+def _latest_etag(fronius_ts: Optional[str], bmk_ts: Optional[str]) -> str:
+    return f"{fronius_ts or '-'}|{bmk_ts or '-'}".replace(" ", "T")
 
 
-@app.get("/dashboard")
-def dashboard():
-    html = """<!doctype html><html><head><meta charset="utf-8">
+class _LatestBroadcaster:
+    """
+    One poller thread checks max(ts) once per second and wakes all stream subscribers when it advances.
+    The thread only runs while at least one subscriber is connected.
+    """
+
+    POLL_S = 1.0
+    KEEPALIVE_S = 5.0
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.version = 0
+        self.frame = b""
+        self.subscribers = 0
+        self.poller: Optional[threading.Thread] = None
+
+    def subscribe(self) -> bool:
+        with self.cond:
+            if self.subscribers >= MAX_STREAMS:
+                return False
+            self.subscribers += 1
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, name="latest-poller", daemon=True)
+                self.poller.start()
+            return True
+
+    def unsubscribe(self) -> None:
+        with self.cond:
+            self.subscribers -= 1
+
+    def _poll(self) -> None:
+        etag = None
+        while True:
+            with self.cond:
+                if self.subscribers <= 0:
+                    self.poller = None
+                    return
+            try:
+                etag = self._refresh(etag)
+            except Exception:
+                app.logger.exception("latest stream: poll failed")
+            time.sleep(self.POLL_S)
+
+    def _refresh(self, etag: Optional[str]) -> str:
+        c = _connect()
+        f_ts = c.execute("SELECT ts FROM fronius ORDER BY ts DESC LIMIT 1").fetchone()
+        b_ts = c.execute("SELECT ts FROM bmk ORDER BY ts DESC LIMIT 1").fetchone()
+        new_etag = _latest_etag(f_ts[0] if f_ts else None, b_ts[0] if b_ts else None)
+        if new_etag == etag:
+            return etag
+
+        f = c.execute("SELECT * FROM fronius ORDER BY ts DESC LIMIT 1").fetchone()
+        b = c.execute("SELECT * FROM bmk ORDER BY ts DESC LIMIT 1").fetchone()
+        frame = b"data: " + orjson.dumps({"fronius": f, "bmk": b}, default=dict) + b"\n\n"
+        with self.cond:
+            self.frame = frame
+            self.version += 1
+            self.cond.notify_all()
+        return new_etag
+
+    def wait(self, seen: int) -> Tuple[int, bytes]:
+        """Blocks until a frame newer than `seen` exists (or keepalive timeout); returns (version, frame)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != seen, timeout=self.KEEPALIVE_S)
+            return self.version, self.frame
+
+
+_broadcaster = _LatestBroadcaster()
+
+
+_DASHBOARD_HTML = """<!doctype html><html><head><meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
     <title>Energy Dashboard</title>
     <style>
@@ -92,9 +167,7 @@ def dashboard():
       <div class="card"><div class="label">Außen</div><div class="val" id="outside">–</div></div>
     </div>
     <script>
-      async function tick(){
-        const r = await fetch('/api/latest',{cache:'no-store'});
-        const j = await r.json();
+      function render(j){
         if(j.fronius){
           pv.textContent = (j.fronius.pv_kw ?? 0).toFixed(1) + " kW";
           load.textContent = (j.fronius.load_kw ?? 0).toFixed(1) + " kW";
@@ -106,10 +179,88 @@ def dashboard():
           outside.textContent = (j.bmk.outside_temp ?? 0).toFixed(1) + " °C";
         }
       }
-      setInterval(tick,2000); tick();
-    </script></body></html>"""
-    return Response(html, mimetype="text/html")
+      async function tick(){
+        const r = await fetch('/api/latest',{cache:'no-cache'});
+        render(await r.json());
+      }
+      function poll(){ setInterval(tick,2000); tick(); }
+      if(window.EventSource){
+        // push on new data; fall back to polling if the server refuses the stream
+        const es = new EventSource('/api/latest/stream');
+        es.onmessage = e => render(JSON.parse(e.data));
+        es.onerror = () => { if(es.readyState === EventSource.CLOSED) poll(); };
+      } else {
+        poll();
+      }
+    </script></body></html>""".encode("utf-8")
+# encoded + compressed once at import; served as-is per request
+_DASHBOARD_HTML_GZ = gzip.compress(_DASHBOARD_HTML, 9)
+
+
+@app.get("/api/health")
+def health():
+    return _json({"status": "ok", "data_dir": str(DATA_DIR), "db": str(DB_FILE), "db_exists": DB_FILE.exists()})
+
+
+@app.get("/api/latest")
+def latest():
+    c = _connect()
+    if request.if_none_match:
+        # ts only; unchanged -> 304 without loading the full rows
+        f_ts = c.execute("SELECT ts FROM fronius ORDER BY ts DESC LIMIT 1").fetchone()
+        b_ts = c.execute("SELECT ts FROM bmk ORDER BY ts DESC LIMIT 1").fetchone()
+        etag = _latest_etag(f_ts[0] if f_ts else None, b_ts[0] if b_ts else None)
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+
+    f = c.execute("SELECT * FROM fronius ORDER BY ts DESC LIMIT 1").fetchone()
+    b = c.execute("SELECT * FROM bmk ORDER BY ts DESC LIMIT 1").fetchone()
+    resp = _json({"fronius": f, "bmk": b})
+    resp.set_etag(_latest_etag(f["ts"] if f else None, b["ts"] if b else None), weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.get("/api/latest/stream")
+def latest_stream():
+    if not _broadcaster.subscribe():
+        return Response("too many streams", status=503, mimetype="text/plain")
+
+    def gen() -> Iterator[bytes]:
+        try:
+            yield b"retry: 3000\n\n"
+            seen = 0
+            while True:
+                version, frame = _broadcaster.wait(seen)
+                if version != seen and frame:
+                    seen = version
+                    yield frame
+                else:
+                    yield b": keepalive\n\n"
+        finally:
+            _broadcaster.unsubscribe()
+
+    return Response(
+        gen(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/dashboard")
+def dashboard():
+    headers = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    if request.accept_encodings["gzip"]:
+        headers["Content-Encoding"] = "gzip"
+        return Response(_DASHBOARD_HTML_GZ, mimetype="text/html", headers=headers)
+    return Response(_DASHBOARD_HTML, mimetype="text/html", headers=headers)
 
 
 if __name__ == "__main__":
-    app.run(host=HOST, port=PORT)
+    from waitress import serve
+
+    # lookahead lets waitress notice closed stream clients on the next keepalive
+    serve(app, host=HOST, port=PORT, threads=4 + MAX_STREAMS, connection_limit=64, channel_request_lookahead=1)
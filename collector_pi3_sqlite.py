@@ -13,10 +13,16 @@ Environment (optional):
     FRONIUS_INTERVAL_S="1"                  # default: 1
     BMK_INTERVAL_S="10"                     # default: 10
     HTTP_TIMEOUT_S="5"                      # default: 5
+    FRONIUS_BATCH_ROWS="10"                 # default: 10 (Zeilen pro Transaktion)
+    BMK_BATCH_ROWS="1"                      # default: 1
+    FLUSH_INTERVAL_S="10"                   # default: 10 (max. Alter gepufferter Zeilen)
+    CHECKPOINT_INTERVAL_S="300"             # default: 300 (WAL-Checkpoint mit TRUNCATE)
 
 Hinweise:
 - SQLite läuft im WAL-Modus (gleichzeitiges Lesen/Schreiben robust).
 - Insert erfolgt idempotent (PRIMARY KEY ts + INSERT OR REPLACE).
+- Zeilen werden gepuffert und gesammelt in einer BEGIN IMMEDIATE-Transaktion geschrieben.
+- WAL bleibt klein: Auto-Checkpoint alle 200 Seiten + periodischer TRUNCATE-Checkpoint.
 """
 
 from __future__ import annotations
@@ -27,12 +33,48 @@ import signal
 import sqlite3
 import threading
 import time
+from collections import deque
 from dataclasses import dataclass
-from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Sequence, Tuple
 
+import msgspec
 import requests
+from requests.adapters import HTTPAdapter
+
+
+# geteilte Session: Keep-Alive statt neuem TCP-Handshake pro Abruf
+_HTTP = requests.Session()
+_HTTP.headers["Connection"] = "keep-alive"
+_HTTP.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=2))
+
+
+class FroniusSite(msgspec.Struct):
+    P_PV: Optional[float] = None
+    P_Grid: Optional[float] = None
+    P_Akku: Optional[float] = None
+    P_Load: Optional[float] = None
+
+
+class FroniusData(msgspec.Struct):
+    Site: FroniusSite
+    # bewusst lose typisiert: ein kaputter Inverter-/SOC-Eintrag soll nur soc=None ergeben,
+    # nicht das ganze Sample (PV/Netz/Last) verwerfen
+    Inverters: Any = None
+
+
+class FroniusBody(msgspec.Struct):
+    Data: FroniusData
+
+
+class FroniusResponse(msgspec.Struct):
+    """Nur die benötigten Felder aus GetPowerFlowRealtimeData; alles andere wird ignoriert."""
+
+    Body: FroniusBody
+
+
+# strict=False: Zahlen als String (z.B. "55.5") werden trotzdem akzeptiert
+_FRONIUS_DECODER = msgspec.json.Decoder(FroniusResponse, strict=False)
 
 
 @dataclass(frozen=True)
@@ -44,6 +86,15 @@ class Settings:
     fronius_interval_s: float
     bmk_interval_s: float
     http_timeout_s: float
+    fronius_batch_rows: int
+    bmk_batch_rows: int
+    flush_interval_s: float
+    checkpoint_interval_s: float
+
+
+def _ts_now() -> str:
+    # gleiches Format wie datetime.now().replace(microsecond=0).isoformat(sep=" ")
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
 
 def _env_float(name: str, default: float) -> float:
@@ -70,42 +121,62 @@ def load_settings() -> Settings:
         fronius_interval_s=max(0.2, _env_float("FRONIUS_INTERVAL_S", 1.0)),
         bmk_interval_s=max(1.0, _env_float("BMK_INTERVAL_S", 10.0)),
         http_timeout_s=max(0.5, _env_float("HTTP_TIMEOUT_S", 5.0)),
+        fronius_batch_rows=max(1, int(_env_float("FRONIUS_BATCH_ROWS", 10))),
+        bmk_batch_rows=max(1, int(_env_float("BMK_BATCH_ROWS", 1))),
+        flush_interval_s=max(1.0, _env_float("FLUSH_INTERVAL_S", 10.0)),
+        checkpoint_interval_s=max(10.0, _env_float("CHECKPOINT_INTERVAL_S", 300.0)),
     )
 
 
-def _connect(db_path: Path) -> sqlite3.Connection:
+def _connect(db_path: Path) -> Tuple[sqlite3.Connection, sqlite3.Connection]:
+    """
+    Returns (writer, reader).
+    - writer: einzige schreibende Verbindung, von beiden Workern geteilt (Zugriff nur unter write_lock)
+    - reader: read-only (mode=ro), blockiert dank WAL nie auf den Writer; der Collector nutzt ihn
+      nur beim Start und schließt ihn danach
+    """
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(
+    writer = sqlite3.connect(
         str(db_path),
         timeout=30,
         isolation_level=None,  # autocommit
         check_same_thread=False,
     )
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA temp_store=MEMORY;")
+    writer.execute("PRAGMA journal_mode=WAL;")
+    writer.execute("PRAGMA synchronous=NORMAL;")
+    writer.execute("PRAGMA temp_store=MEMORY;")
+    writer.execute("PRAGMA busy_timeout=30000;")
+    writer.execute("PRAGMA cache_size=-20000;")
+    writer.execute("PRAGMA mmap_size=67108864;")
+    writer.execute("PRAGMA wal_autocheckpoint=200;")  # ~800KB WAL bei 4KB Seiten
+
+    reader = _connect_readonly(db_path)
+    return writer, reader
+
+
+def _connect_readonly(db_path: Path) -> sqlite3.Connection:
+    # journal_mode wird nur vom Writer gesetzt (auf mode=ro nicht erlaubt)
+    conn = sqlite3.connect(
+        db_path.resolve().as_uri() + "?mode=ro",  # as_uri() percent-encodes #, ?, % and spaces
+        uri=True,
+        timeout=30,
+        isolation_level=None,
+    )
     conn.execute("PRAGMA busy_timeout=30000;")
     return conn
 
 
-def init_db(conn: sqlite3.Connection) -> None:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS fronius (
+# ts ist PRIMARY KEY; WITHOUT ROWID -> Tabelle ist direkt nach ts geclustert (kein Zusatzindex nötig)
+_TABLES: Dict[str, str] = {
+    "fronius": """
             ts TEXT PRIMARY KEY,
             pv_kw REAL,
             grid_kw REAL,
             battery_kw REAL,
             load_kw REAL,
             soc REAL
-        );
-        """
-    )
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_fronius_ts ON fronius(ts);")
-
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS bmk (
+    """,
+    "bmk": """
             ts TEXT PRIMARY KEY,
             boiler_temp REAL,
             outside_temp REAL,
@@ -113,26 +184,56 @@ def init_db(conn: sqlite3.Connection) -> None:
             buffer_mid REAL,
             buffer_bottom REAL,
             hot_water REAL
-        );
-        """
-    )
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_bmk_ts ON bmk(ts);")
+    """,
+}
+
+# ältere Versionen: redundant zum PRIMARY KEY bzw. zur geclusterten Tabelle
+_OBSOLETE_INDEXES = ("idx_fronius_ts", "idx_fronius_ts_cover", "idx_bmk_ts")
+
+
+def _migrate_without_rowid(conn: sqlite3.Connection, table: str, columns_sql: str) -> None:
+    """Kopiert eine bestehende rowid-Tabelle einmalig in eine WITHOUT ROWID-Tabelle."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?;", (table,)).fetchone()
+    if row is None or "WITHOUT ROWID" in (row[0] or "").upper():
+        return
+
+    logging.info("Migriere Tabelle %s auf WITHOUT ROWID...", table)
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        conn.execute(f"CREATE TABLE {table}_new ({columns_sql}) WITHOUT ROWID;")
+        conn.execute(f"INSERT OR REPLACE INTO {table}_new SELECT * FROM {table};")
+        conn.execute(f"DROP TABLE {table};")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table};")
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+    logging.info("Migration %s abgeschlossen.", table)
+
+
+def init_db(conn: sqlite3.Connection) -> None:
+    for name in _OBSOLETE_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name};")
+
+    for table, columns_sql in _TABLES.items():
+        _migrate_without_rowid(conn, table, columns_sql)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_sql}) WITHOUT ROWID;")
 
 
 def fetch_fronius(settings: Settings) -> Optional[Dict[str, Any]]:
     try:
-        r = requests.get(settings.fronius_url, timeout=settings.http_timeout_s)
+        r = _HTTP.get(settings.fronius_url, timeout=settings.http_timeout_s)
         r.raise_for_status()
-        data = r.json()
+        data = _FRONIUS_DECODER.decode(r.content).Body.Data
 
-        site = data["Body"]["Data"]["Site"]
-        inverters = data["Body"]["Data"].get("Inverters", {})
+        site = data.Site
+        inverters = data.Inverters
 
-        ts = datetime.now().replace(microsecond=0).isoformat(sep=" ")
-        pv_kw = abs((site.get("P_PV") or 0) / 1000)
-        grid_kw = abs((site.get("P_Grid") or 0) / 1000)
-        battery_kw = abs((site.get("P_Akku") or 0) / 1000)
-        load_kw = abs((site.get("P_Load") or 0) / 1000)
+        ts = _ts_now()
+        pv_kw = abs((site.P_PV or 0) / 1000)
+        grid_kw = abs((site.P_Grid or 0) / 1000)
+        battery_kw = abs((site.P_Akku or 0) / 1000)
+        load_kw = abs((site.P_Load or 0) / 1000)
 
         soc = None
         if isinstance(inverters, dict) and inverters:
@@ -154,96 +255,176 @@ def fetch_fronius(settings: Settings) -> Optional[Dict[str, Any]]:
             "load_kw": float(load_kw),
             "soc": soc,
         }
+    except msgspec.DecodeError as e:
+        logging.warning("Fronius: ungültige Antwort (%s)", e)
+        return None
     except Exception:
         logging.exception("Fronius: Fehler beim Abrufen")
         return None
 
 
-def _to_float(x: Any) -> Optional[float]:
-    if x is None:
-        return None
-    s = str(x).strip().replace(",", ".")
-    if s == "":
-        return None
+# Positionen (in den nicht-leeren Zeilen) der gespeicherten BMK-Werte, Reihenfolge wie _BMK_FIELDS
+_BMK_IDX = (1, 2, 4, 5, 6, 12)
+_BMK_FIELDS = ("boiler_temp", "outside_temp", "buffer_top", "buffer_mid", "buffer_bottom", "hot_water")
+
+
+def _to_float(s: str) -> Optional[float]:
+    # s ist bereits gestrippt und nicht leer
     try:
-        return float(s)
-    except Exception:
+        return float(s.replace(",", "."))
+    except ValueError:
         return None
 
 
 def fetch_bmk(settings: Settings) -> Optional[Dict[str, Any]]:
     try:
-        r = requests.get(settings.bmk_url, timeout=settings.http_timeout_s)
+        r = _HTTP.get(settings.bmk_url, timeout=settings.http_timeout_s)
         r.raise_for_status()
 
-        lines = r.text.split("\n")
-        values = [line.strip() for line in lines if line.strip()]
+        # r.content statt r.text: spart die Zeichensatz-Erkennung von requests
+        values = [v for v in map(str.strip, r.content.decode("ascii", "replace").split("\n")) if v]
 
-        if len(values) <= 12:
+        if len(values) <= _BMK_IDX[-1]:
             logging.warning("BMK: zu wenige Werte (%s) – Antwort evtl. unvollständig", len(values))
             return None
 
-        ts = datetime.now().replace(microsecond=0).isoformat(sep=" ")
-        return {
-            "ts": ts,
-            "boiler_temp": _to_float(values[1]),
-            "outside_temp": _to_float(values[2]),
-            "buffer_top": _to_float(values[4]),
-            "buffer_mid": _to_float(values[5]),
-            "buffer_bottom": _to_float(values[6]),
-            "hot_water": _to_float(values[12]),
-        }
+        ts = _ts_now()
+        row: Dict[str, Any] = {"ts": ts}
+        for field, i in zip(_BMK_FIELDS, _BMK_IDX):
+            row[field] = _to_float(values[i])
+        return row
     except Exception:
         logging.exception("BMK: Fehler beim Abrufen")
         return None
 
 
-def insert_fronius(conn: sqlite3.Connection, row: Dict[str, Any]) -> None:
-    conn.execute(
+def insert_fronius(conn: sqlite3.Connection, rows: Sequence[Dict[str, Any]]) -> None:
+    conn.executemany(
         """
         INSERT OR REPLACE INTO fronius (ts, pv_kw, grid_kw, battery_kw, load_kw, soc)
         VALUES (:ts, :pv_kw, :grid_kw, :battery_kw, :load_kw, :soc);
         """,
-        row,
+        rows,
     )
 
 
-def insert_bmk(conn: sqlite3.Connection, row: Dict[str, Any]) -> None:
-    conn.execute(
+def insert_bmk(conn: sqlite3.Connection, rows: Sequence[Dict[str, Any]]) -> None:
+    conn.executemany(
         """
         INSERT OR REPLACE INTO bmk (ts, boiler_temp, outside_temp, buffer_top, buffer_mid, buffer_bottom, hot_water)
         VALUES (:ts, :boiler_temp, :outside_temp, :buffer_top, :buffer_mid, :buffer_bottom, :hot_water);
         """,
-        row,
+        rows,
     )
 
 
 class PeriodicWorker(threading.Thread):
-    def __init__(self, name: str, interval_s: float, fetch_fn, insert_fn, conn: sqlite3.Connection, settings: Settings, stop_event: threading.Event):
+    def __init__(
+        self,
+        name: str,
+        interval_s: float,
+        fetch_fn,
+        insert_fn,
+        conn: sqlite3.Connection,
+        write_lock: threading.Lock,
+        settings: Settings,
+        stop_event: threading.Event,
+        batch_rows: int = 1,
+        flush_interval_s: float = 10.0,
+    ):
         super().__init__(name=name, daemon=True)
         self.interval_s = float(interval_s)
         self.fetch_fn = fetch_fn
         self.insert_fn = insert_fn
         self.conn = conn
+        self.write_lock = write_lock
         self.settings = settings
         self.stop_event = stop_event
+        self.batch_rows = max(1, int(batch_rows))
+        self.flush_interval_s = float(flush_interval_s)
+        # begrenzt, falls die DB länger nicht schreibbar ist (älteste Zeilen fallen raus)
+        self.buffer: deque = deque(maxlen=max(1000, self.batch_rows * 100))
+        self.last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        rows = list(self.buffer)
+        try:
+            with self.write_lock:
+                self.conn.execute("BEGIN IMMEDIATE;")
+                try:
+                    self.insert_fn(self.conn, rows)
+                except Exception:
+                    self.conn.execute("ROLLBACK;")
+                    raise
+                self.conn.execute("COMMIT;")
+        except Exception:
+            logging.exception("%s: Fehler beim DB-Insert (%s Zeilen gepuffert)", self.name, len(rows))
+            return
+        for _ in rows:
+            self.buffer.popleft()
 
     def run(self) -> None:
         next_t = time.monotonic()
         while not self.stop_event.is_set():
             now = time.monotonic()
             if now < next_t:
-                self.stop_event.wait(next_t - now)
+                delta = next_t - now
+                if delta < 0.1:
+                    time.sleep(delta)
+                else:
+                    self.stop_event.wait(delta)
                 continue
 
             row = self.fetch_fn(self.settings)
             if row:
-                try:
-                    self.insert_fn(self.conn, row)
-                except Exception:
-                    logging.exception("%s: Fehler beim DB-Insert", self.name)
+                self.buffer.append(row)
+            if len(self.buffer) >= self.batch_rows or time.monotonic() - self.last_flush >= self.flush_interval_s:
+                self.flush()
 
+            # feste Phase; verpasste Ticks (z.B. HTTP-Timeout) werden übersprungen statt nachgeholt
             next_t += self.interval_s
+            now = time.monotonic()
+            if now > next_t:
+                skipped = int((now - next_t) // self.interval_s)
+                if skipped:
+                    logging.warning("%s: %s Tick(s) übersprungen (Abruf dauerte zu lange)", self.name, skipped)
+                next_t = now
+
+        # Restpuffer beim Stoppen sichern
+        self.flush()
+
+
+class CheckpointWorker(threading.Thread):
+    """Setzt die WAL-Datei periodisch auf 0 Bytes zurück (zwischen zwei Flushes der Worker)."""
+
+    # kurzes Warten auf Leser, damit write_lock nicht bis zu 30s blockiert bleibt
+    BUSY_TIMEOUT_MS = 2000
+
+    def __init__(self, interval_s: float, conn: sqlite3.Connection, write_lock: threading.Lock, stop_event: threading.Event):
+        super().__init__(name="checkpoint", daemon=True)
+        self.interval_s = float(interval_s)
+        self.conn = conn
+        self.write_lock = write_lock
+        self.stop_event = stop_event
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval_s):
+            try:
+                with self.write_lock:
+                    if self.stop_event.is_set():
+                        break
+                    self.conn.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS};")
+                    try:
+                        busy, log_pages, done = self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+                    finally:
+                        self.conn.execute("PRAGMA busy_timeout=30000;")
+                if busy:
+                    logging.info("Checkpoint: Leser aktiv, %s/%s Seiten übertragen", done, log_pages)
+            except Exception:
+                logging.exception("Checkpoint: Fehler")
 
 
 def main() -> None:
@@ -261,8 +442,14 @@ def main() -> None:
     logging.info("Fronius URL: %s", settings.fronius_url)
     logging.info("BMK URL: %s", settings.bmk_url)
 
-    conn = _connect(settings.db_file)
+    conn, reader = _connect(settings.db_file)
     init_db(conn)
+    write_lock = threading.Lock()
+
+    for table in ("fronius", "bmk"):
+        last = reader.execute(f"SELECT MAX(ts) FROM {table}").fetchone()[0]
+        logging.info("Letzter Eintrag %s: %s", table, last or "–")
+    reader.close()
 
     stop_event = threading.Event()
 
@@ -279,8 +466,11 @@ def main() -> None:
         fetch_fn=fetch_fronius,
         insert_fn=insert_fronius,
         conn=conn,
+        write_lock=write_lock,
         settings=settings,
         stop_event=stop_event,
+        batch_rows=settings.fronius_batch_rows,
+        flush_interval_s=settings.flush_interval_s,
     )
     bmk_worker = PeriodicWorker(
         name="bmk",
@@ -288,20 +478,41 @@ def main() -> None:
         fetch_fn=fetch_bmk,
         insert_fn=insert_bmk,
         conn=conn,
+        write_lock=write_lock,
         settings=settings,
         stop_event=stop_event,
+        batch_rows=settings.bmk_batch_rows,
+        flush_interval_s=settings.flush_interval_s,
+    )
+
+    cp_worker = CheckpointWorker(
+        interval_s=settings.checkpoint_interval_s,
+        conn=conn,
+        write_lock=write_lock,
+        stop_event=stop_event,
     )
 
     fr_worker.start()
     bmk_worker.start()
+    cp_worker.start()
 
     while not stop_event.is_set():
         time.sleep(0.5)
 
-    try:
-        conn.close()
-    except Exception:
-        pass
+    # Worker schreiben ihren Restpuffer, erst danach Verbindungen schließen
+    workers = (fr_worker, bmk_worker, cp_worker)
+    for w in workers:
+        w.join(timeout=settings.http_timeout_s + 5)
+
+    alive = [w.name for w in workers if w.is_alive()]
+    if alive:
+        # Writer offen lassen: ein noch laufender Thread nutzt ihn ggf. (Prozessende schließt ihn)
+        logging.warning("Threads noch aktiv (%s) – Writer-Verbindung wird nicht geschlossen", ", ".join(alive))
+    else:
+        try:
+            conn.close()
+        except Exception:
+            pass
     logging.info("Collector beendet.")
 
 
@@ -9,6 +9,12 @@ echo "Erstelle Datenverzeichnis: ${DATA_DIR}"
 sudo mkdir -p "${DATA_DIR}"
 sudo chown -R "${USER_NAME}:${USER_NAME}" "${DATA_DIR}"
 
+echo "Installiere Python-Abhängigkeiten (requirements.txt)..."
+# vor dem Start der Services, sonst Restart-Schleife durch ImportError
+# (Fallback für Systeme mit "externally-managed-environment", z.B. Raspberry Pi OS Bookworm)
+sudo /usr/bin/python3 -m pip install -r requirements.txt \
+  || sudo /usr/bin/python3 -m pip install --break-system-packages -r requirements.txt
+
 echo "Installiere systemd Services..."
 sudo install -m 644 energy-collector.service /etc/systemd/system/energy-collector.service
 sudo install -m 644 energy-api.service /etc/systemd/system/energy-api.service